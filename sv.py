@@ -1,36 +1,93 @@
 #!/usr/bin/env python3
 # server.py
-from flask import Flask, request, jsonify, render_template, make_response
+#
+# Production (self-hosted): run under gunicorn with a gevent worker, e.g.
+#   gunicorn -k gevent -w 1 --worker-connections 1000 sv:app
+# The gevent worker monkey-patches sockets itself, so blocking g4f/requests I/O
+# yields instead of pinning a thread. Keep a single worker: chat history lives in
+# process memory, so extra workers would each see a different history.
+# Without gevent, a threaded worker with keep-alive works too:
+#   gunicorn -k gthread -w 1 --threads 16 --keep-alive 30 sv:app
+# `python sv.py` serves with waitress when it is installed (unless FLASK_ENV=development),
+# otherwise with Werkzeug's dev server.
+from flask import Flask, Response, request, render_template, make_response
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
 import json
+import gzip
+import re
 import threading
 import time
+from collections import OrderedDict, deque
+from itertools import count, islice
 from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from functools import wraps
+from email.utils import formatdate
 import logging
-import pytz
+
+# orjson is an optional speedup (C encoder, emits UTF-8 bytes directly)
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # ---------------- Config ----------------
-VIETNAM_TZ = pytz.timezone(os.getenv("VIETNAM_TZ", "Asia/Ho_Chi_Minh"))
+VIETNAM_TZ_NAME = os.getenv("VIETNAM_TZ", "Asia/Ho_Chi_Minh")
+if VIETNAM_TZ_NAME == "Asia/Ho_Chi_Minh":
+    # Vietnam has had no DST since 1975: a fixed UTC+7 offset is exact and cheap
+    VIETNAM_TZ = timezone(timedelta(hours=7), name="ICT")
+else:
+    from zoneinfo import ZoneInfo
+    VIETNAM_TZ = ZoneInfo(VIETNAM_TZ_NAME)
 MAX_MESSAGES = int(os.getenv("MAX_MESSAGES", 80))
 MAX_INPUT_MESSAGES = int(os.getenv("MAX_INPUT_MESSAGES", 3))
+# Character budgets for history sent to the model: per message, and for the whole history tail
+MAX_PAYLOAD_MSG_CHARS = int(os.getenv("MAX_PAYLOAD_MSG_CHARS", 4000))
+MAX_PAYLOAD_CHARS = int(os.getenv("MAX_PAYLOAD_CHARS", 16000))
 MODEL_NAME = os.getenv("MODEL_NAME", "gpt-4o-mini")
 API_CALL_TIMEOUT = float(os.getenv("API_CALL_TIMEOUT", 15.0))
+# Upper bound for request bodies; a 1500-char message fits comfortably even fully \u-escaped
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", 16384))
+# Server-side exact-match reply cache (same TTL as the UI's own cache); TTL 0 disables it
+REPLY_CACHE_TTL = float(os.getenv("REPLY_CACHE_TTL", 180))
+REPLY_CACHE_SIZE = int(os.getenv("REPLY_CACHE_SIZE", 256))
+# SSE batching: flush a frame once this many characters are buffered or this many ms have passed
+SSE_FLUSH_CHARS = int(os.getenv("SSE_FLUSH_CHARS", 64))
+SSE_FLUSH_MS = float(os.getenv("SSE_FLUSH_MS", 50))
+# How often the system prompt's embedded clock is rebuilt (at least 1s: it's used as a divisor)
+SYSTEM_REFRESH_SECONDS = max(1.0, float(os.getenv("SYSTEM_REFRESH_SECONDS", 300)))
+
+FALLBACK_REPLY = "Xin lỗi, hiện tại tôi không truy cập được mô-đun trả lời nhanh. Bạn có thể thử lại hoặc chờ một chút."
+
+# Local shortcuts handled without calling the model
+CLEAR_COMMANDS = frozenset(("clear","/clear","xóa","xoa"))
+# Longer messages can't be a clear command, so they skip hashing for the set lookup
+CLEAR_COMMAND_MAX_LEN = max(map(len, CLEAR_COMMANDS))
+# One compiled alternation instead of a substring scan per keyword
+TIME_KEYWORDS_RE = re.compile(r"giờ|thời\s*gian|ngày|tháng|năm|bây\s*giờ|hiện\s*tại", re.IGNORECASE)
+
+# Vietnamese calendar names, indexed by datetime.weekday()
+WEEKDAYS_VN = ('Thứ Hai','Thứ Ba','Thứ Tư','Thứ Năm','Thứ Sáu','Thứ Bảy','Chủ Nhật')
+MONTHS_VN = tuple(f'Tháng {i}' for i in range(1, 13))
+LOCATION_VN = 'Khánh Hòa, Việt Nam'
+SYSTEM_PROMPT_TEMPLATE = "Bạn là trợ lý AI tại {location}. Thời gian hiện tại: {full_datetime}."
 
 # Thread pool for light background tasks
 executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="chatbot")
 
-# Logging
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+# Logging (LOG_LEVEL=WARNING in production turns the per-request INFO lines into a level check)
+LOG_LEVEL = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger("ultrafast")
-logger.setLevel(logging.INFO)
+logger.setLevel(LOG_LEVEL)
 
 # Flask app
 app = Flask(__name__, template_folder="templates")
 # Allow all origins for /api/*
 CORS(app, resources={r"/api/*": {"origins": "*"}})
+app.config["MAX_CONTENT_LENGTH"] = MAX_BODY_BYTES
 app.logger.disabled = True
 
 # Helper: run function in background
@@ -40,98 +97,214 @@ def async_task(func):
         return executor.submit(func, *args, **kwargs)
     return wrapper
 
-# ---------------- Bot Class ----------------
-class UltraFastChatBot:
-    _instance = None
-    _lock = threading.Lock()
+# Helper: JSON encode to UTF-8 bytes / decode from str or bytes
+def json_dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
 
-    def __new__(cls, *args, **kwargs):
-        if not cls._instance:
-            with cls._lock:
-                if not cls._instance:
-                    cls._instance = super().__new__(cls)
-        return cls._instance
+def json_loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
 
+# ---------------- Bot Class ----------------
+class UltraFastChatBot:
     def __init__(self, max_messages=MAX_MESSAGES):
-        if getattr(self, "initialized", False):
-            return
-
-        # lazy import g4f
-        try:
-            import g4f  # noqa: F401
-            self._client_available = True
-        except Exception as e:
-            logger.warning(f"G4F import failed (will use fallback): {e}")
-            self._client_available = False
+        # g4f is resolved lazily (see _get_completion); False once its import has failed
+        self._create_completion = None
+        self._client_available = True
+        self._g4f_lock = threading.Lock()
 
         self.max_messages = max_messages
-        self.messages = []  # list of {"role","content","timestamp"}
-        self._message_cache = {}
+        # History is kept split: the (single) system prompt and a bounded deque of
+        # user/assistant turns. Items are {"role","content","timestamp"} dicts.
+        # Writers don't lock: rebinding _system_msgs and deque.extend/clear are atomic
+        # under the GIL, and readers copy the deque with a C-level list() first.
+        self._system_msgs = []
+        self._system_payload = []  # _system_msgs as outbound {"role","content"} dicts
+        self._sys_refresh_bucket = -1
+        self._convo_msgs = deque(maxlen=max_messages)
+        self._history_versions = count(1)  # next() is atomic: unique version per change
+        self._history_version = 0
+        self._history_blob = (None, None)  # (version, encoded /api/history body)
+        self._history_mtime = time.time()
+        self._boot_id = format(int(self._history_mtime * 1000), "x")
         self._last_save_time = 0.0
         self._save_interval = 3.0
-        self._lock = threading.RLock()
+        self._reply_cache = OrderedDict()  # (normalized input, refresh bucket, history tail) -> (expires_at, reply), LRU order
+        self._reply_cache_lock = threading.Lock()
         self._vietnam_tz = VIETNAM_TZ
-        self.initialized = True
+        self._time_info_cache = (None, None)  # (epoch second, time info dict)
+
+    def _get_completion(self):
+        # Importing g4f loads every provider module: do it on the first chat, not at cold start
+        if self._create_completion is None and self._client_available:
+            with self._g4f_lock:
+                if self._create_completion is None and self._client_available:
+                    try:
+                        import g4f
+                        self._create_completion = g4f.ChatCompletion.create
+                    except Exception as e:
+                        logger.warning(f"G4F import failed (will use fallback): {e}")
+                        self._client_available = False
+        return self._create_completion
 
     def _now_ts(self):
-        return datetime.now(self._vietnam_tz).strftime("%Y-%m-%d %H:%M:%S")
+        # "%Y-%m-%d %H:%M:%S" from the per-second time info, not a fresh datetime.now()
+        return self.get_vietnam_time_info()['stamp']
 
     def get_vietnam_time_info(self):
-        vn = datetime.now(self._vietnam_tz)
-        weekdays = ['Thứ Hai','Thứ Ba','Thứ Tư','Thứ Năm','Thứ Sáu','Thứ Bảy','Chủ Nhật']
-        weekday_vn = weekdays[vn.weekday()]
-        months = ['Tháng 1','Tháng 2','Tháng 3','Tháng 4','Tháng 5','Tháng 6',
-                  'Tháng 7','Tháng 8','Tháng 9','Tháng 10','Tháng 11','Tháng 12']
-        month_vn = months[vn.month - 1]
-        return {
-            'current_time': vn.strftime('%H:%M:%S'),
+        # Output only has seconds resolution: reuse the result within the same second
+        now = time.time()
+        sec = int(now)
+        cached_sec, cached_info = self._time_info_cache
+        if cached_sec == sec:
+            return cached_info
+        vn = datetime.fromtimestamp(now, self._vietnam_tz)
+        weekday_vn = WEEKDAYS_VN[vn.weekday()]
+        month_vn = MONTHS_VN[vn.month - 1]
+        clock = f"{vn.hour:02d}:{vn.minute:02d}:{vn.second:02d}"
+        info = {
+            'current_time': clock,
             'current_date': f"{vn.day} {month_vn} năm {vn.year}",
             'weekday': weekday_vn,
-            'full_datetime': f"{weekday_vn}, {vn.day} {month_vn} {vn.year} lúc {vn.strftime('%H:%M:%S')}",
+            'full_datetime': f"{weekday_vn}, {vn.day} {month_vn} {vn.year} lúc {clock}",
             'timestamp': vn.timestamp(),
-            'location': 'Khánh Hòa, Việt Nam'
+            'location': LOCATION_VN,
+            'stamp': f"{vn.year:04d}-{vn.month:02d}-{vn.day:02d} {clock}"
         }
+        self._time_info_cache = (sec, info)
+        return info
+
+    @property
+    def messages(self):
+        # Flat view (system first) for readers such as /api/history and /api/status
+        return self._system_msgs + list(self._convo_msgs)
 
-    def _trim_messages(self):
-        if len(self.messages) > self.max_messages:
-            with self._lock:
-                system_msgs = [m for m in self.messages if m.get("role") == "system"]
-                recent = [m for m in self.messages if m.get("role") != "system"][-int(self.max_messages*0.6):]
-                self.messages = system_msgs + recent
+    def message_count(self):
+        return len(self._system_msgs) + len(self._convo_msgs)
 
     def clear_history(self):
-        with self._lock:
-            self.messages = []
-            self._message_cache.clear()
+        # Each step is atomic on its own and clearing is idempotent, so concurrent clears need no lock
+        self._system_msgs = []
+        self._system_payload = []
+        self._convo_msgs.clear()
+        # The reply cache is kept: its keys carry the whole outbound context, so entries made
+        # in the old conversation can't match in the new one
+        self._mark_history_changed()
+
+    def record_turn(self, user_input, reply):
+        ts = self._now_ts()
+        # One extend keeps the user/assistant pair adjacent; deque(maxlen) drops the oldest turns
+        self._convo_msgs.extend((
+            {"role":"user","content":user_input,"timestamp":ts},
+            {"role":"assistant","content":reply,"timestamp":ts},
+        ))
+        self._mark_history_changed()
+
+    def _mark_history_changed(self):
+        # Call after the mutation is visible, so a reader never tags new data with an old version
+        self._history_mtime = time.time()
+        self._history_version = next(self._history_versions)
+
+    def history_snapshot(self):
+        # (etag, last_modified, body) for /api/history.
+        # The last 30 messages are encoded once per history version. The version is read
+        # before the messages, so a racing write can only make the body newer than its tag.
+        version = self._history_version
+        mtime = self._history_mtime
+        cached_version, blob = self._history_blob
+        if cached_version != version:
+            blob = json_dumps({"ok": True, "messages": self.messages[-30:]})
+            self._history_blob = (version, blob)
+        etag = f'"{self._boot_id}-{version}"'
+        return etag, formatdate(mtime, usegmt=True), blob
 
     def _build_minimal_payload(self, user_input):
-        system_msgs = [{"role": m["role"], "content": m["content"]} for m in self.messages if m.get("role") == "system"]
-        non_system = [{"role": m["role"], "content": m["content"]} for m in self.messages if m.get("role") in ("user","assistant")]
-        recent = non_system[-MAX_INPUT_MESSAGES:] if non_system else []
-        payload = system_msgs + recent + [{"role": "user", "content": user_input}]
+        # O(MAX_INPUT_MESSAGES): only the tail of the turn deque is copied (in C, so no
+        # concurrent append can interleave) before building the outbound dicts
+        convo = self._convo_msgs
+        tail = list(islice(convo, max(0, len(convo) - MAX_INPUT_MESSAGES), None))
+        # timestamps are stripped: OpenAI-compatible backends may reject unknown message keys.
+        # Walk newest-first so the oldest turns are the ones dropped once the budget runs out
+        recent = []
+        budget = MAX_PAYLOAD_CHARS
+        for m in reversed(tail):
+            content = m["content"]
+            if len(content) > MAX_PAYLOAD_MSG_CHARS:
+                content = content[:MAX_PAYLOAD_MSG_CHARS] + "…"
+            budget -= len(content)
+            if budget < 0:
+                break
+            recent.append({"role": m["role"], "content": content})
+        recent.reverse()
+        payload = self._system_payload + recent
+        payload.append({"role": "user", "content": user_input})
         return payload
 
     def add_system_with_time(self):
-        with self._lock:
-            self.messages = [m for m in self.messages if m.get("role") != "system"]
-            time_info = self.get_vietnam_time_info()
-            system_content = f"Bạn là trợ lý AI tại {time_info['location']}. Thời gian hiện tại: {time_info['full_datetime']}."
-            self.messages.insert(0, {"role":"system","content":system_content,"timestamp": self._now_ts()})
-
-    def get_response_ultra_fast(self, user_input):
+        time_info = self.get_vietnam_time_info()
+        system_content = SYSTEM_PROMPT_TEMPLATE.format(location=time_info['location'], full_datetime=time_info['full_datetime'])
+        self._system_payload = [{"role":"system","content":system_content}]
+        self._system_msgs = [{"role":"system","content":system_content,"timestamp": self._now_ts()}]
+        self._mark_history_changed()
+
+    def _reply_cache_key(self, user_input_lower, payload_messages):
+        # Normalized question + history tail sent ahead of it, so a follow-up like "tại sao?"
+        # only hits within the same conversation. The system prompt is keyed by its refresh
+        # bucket, not its text: its clock is stamped when it is (re)built, so the text differs
+        # after every clear even though the model sees the same time window
+        tail = tuple((m["role"], m["content"]) for m in payload_messages[:-1] if m["role"] != "system")
+        return (" ".join(user_input_lower.split()), self._sys_refresh_bucket, tail)
+
+    def _cached_reply(self, key):
+        if REPLY_CACHE_TTL <= 0:
+            return None
+        with self._reply_cache_lock:
+            hit = self._reply_cache.get(key)
+            if hit is None:
+                return None
+            if hit[0] < time.time():
+                del self._reply_cache[key]
+                return None
+            self._reply_cache.move_to_end(key)
+            return hit[1]
+
+    def _cache_reply(self, key, reply):
+        if REPLY_CACHE_TTL <= 0 or reply == FALLBACK_REPLY:
+            return
+        with self._reply_cache_lock:
+            self._reply_cache[key] = (time.time() + REPLY_CACHE_TTL, reply)
+            self._reply_cache.move_to_end(key)
+            while len(self._reply_cache) > REPLY_CACHE_SIZE:
+                self._reply_cache.popitem(last=False)
+
+    def _prepare_payload(self, user_input):
+        # (re)build the system message when missing or once per SYSTEM_REFRESH_SECONDS window
+        bucket = int(time.time() // SYSTEM_REFRESH_SECONDS)
+        if not self._system_msgs or bucket != self._sys_refresh_bucket:
+            self._sys_refresh_bucket = bucket
+            self.add_system_with_time()
+        return self._build_minimal_payload(user_input)
+
+    def get_response_ultra_fast(self, user_input, user_input_lower=None):
         start = time.time()
         try:
-            # ensure system message exists periodically
-            if not any(m.get("role") == "system" for m in self.messages) or len(self.messages) % 5 == 0:
-                self.add_system_with_time()
+            payload_messages = self._prepare_payload(user_input)
 
-            payload_messages = self._build_minimal_payload(user_input)
+            # exact repeat of a recent question: answer without calling g4f
+            cache_key = self._reply_cache_key(user_input_lower or user_input.lower(), payload_messages)
+            cached = self._cached_reply(cache_key)
+            if cached is not None:
+                self.record_turn(user_input, cached)
+                return cached
 
             bot_reply = None
-            if self._client_available:
+            create_completion = self._get_completion()
+            if create_completion is not None:
                 try:
-                    import g4f
-                    response = g4f.ChatCompletion.create(
+                    response = create_completion(
                         model=MODEL_NAME,
                         messages=payload_messages,
                         max_tokens=600,
@@ -148,14 +321,10 @@ class UltraFastChatBot:
                     bot_reply = None
 
             if not bot_reply or len(bot_reply) < 2:
-                bot_reply = "Xin lỗi, hiện tại tôi không truy cập được mô-đun trả lời nhanh. Bạn có thể thử lại hoặc chờ một chút."
+                bot_reply = FALLBACK_REPLY
 
-            ts = self._now_ts()
-            with self._lock:
-                self.messages.append({"role":"user","content":user_input,"timestamp":ts})
-                self.messages.append({"role":"assistant","content":bot_reply,"timestamp":ts})
-                if len(self.messages) > int(self.max_messages * 0.8):
-                    self._trim_messages()
+            self.record_turn(user_input, bot_reply)
+            self._cache_reply(cache_key, bot_reply)
 
             elapsed = time.time() - start
             if elapsed > 10:
@@ -164,106 +333,225 @@ class UltraFastChatBot:
         except Exception as e:
             logger.error(f"Error in get_response_ultra_fast: {e}", exc_info=True)
             try:
-                with self._lock:
-                    self.messages.append({"role":"user","content":user_input,"timestamp": self._now_ts()})
+                self._convo_msgs.append({"role":"user","content":user_input,"timestamp": self._now_ts()})
+                self._mark_history_changed()
             except:
                 pass
             return "Hệ thống đang bận, vui lòng thử lại sau ít phút."
 
-# Global bot
+    def stream_response(self, user_input, user_input_lower=None):
+        # Yield reply text as g4f produces it; the full turn is recorded once the stream ends
+        # (also when the client disconnects mid-stream).
+        payload_messages = self._prepare_payload(user_input)
+        cache_key = self._reply_cache_key(user_input_lower or user_input.lower(), payload_messages)
+        cached = self._cached_reply(cache_key)
+        if cached is not None:
+            self.record_turn(user_input, cached)
+            yield cached
+            return
+
+        parts = []
+        try:
+            create_completion = self._get_completion()
+            if create_completion is not None:
+                try:
+                    chunks = create_completion(
+                        model=MODEL_NAME,
+                        messages=payload_messages,
+                        max_tokens=600,
+                        temperature=0.5,
+                        top_p=0.9,
+                        timeout=API_CALL_TIMEOUT,
+                        stream=True
+                    )
+                    for chunk in chunks:
+                        # providers may also yield non-text markers (usage, finish reason)
+                        if isinstance(chunk, str) and chunk:
+                            parts.append(chunk)
+                            yield chunk
+                except Exception as e:
+                    if parts:
+                        # cut off mid-reply: re-raise so the caller flags the partial text as an error
+                        raise
+                    logger.error(f"G4F stream error: {e}", exc_info=True)
+            if not "".join(parts).strip():
+                parts = [FALLBACK_REPLY]
+                yield FALLBACK_REPLY
+            else:
+                self._cache_reply(cache_key, "".join(parts).strip())
+        finally:
+            self.record_turn(user_input, "".join(parts).strip() or FALLBACK_REPLY)
+
+# Global bot (the one instance the app uses)
 bot = UltraFastChatBot()
 
 # ---------------- Helpers / Routes ----------------
-def json_response(payload, status=200):
-    resp = make_response(json.dumps(payload, ensure_ascii=False), status)
+def json_bytes_response(body, status=200):
+    # body is already-encoded JSON (bytes or str)
+    resp = make_response(body, status)
     resp.headers["Content-Type"] = "application/json; charset=utf-8"
-    resp.headers["Connection"] = "close"
     return resp
 
+def json_response(payload, status=200):
+    return json_bytes_response(json_dumps(payload), status)
+
+# Constant bodies are encoded once; a fresh Response is still built per request since CORS mutates headers
+PREFLIGHT_BODY = json_dumps({"ok": True, "msg": "preflight"})
+CLEARED_BODY = json_dumps({"ok": True, "message": "Cleared"})
+ERR_INVALID_BODY = json_dumps({"ok": False, "error": "Invalid JSON or empty body"})
+ERR_EMPTY_BODY = json_dumps({"ok": False, "error": "Empty message"})
+ERR_TOO_LONG_BODY = json_dumps({"ok": False, "error": "Message too long"})
+ERR_TOO_LARGE_BODY = json_dumps({"ok": False, "error": "Payload too large"})
+ERR_NOT_FOUND_BODY = json_dumps({"ok": False, "error": "Not found"})
+ERR_SERVER_BODY = json_dumps({"ok": False, "error": "Server error"})
+
+# Pre-rendered UI: the template has no context, so render + minify + gzip once at import
+def _minify_html(html):
+    # Drop indentation and blank lines only; newlines stay so inline JS keeps its ASI semantics
+    return "\n".join(line.strip() for line in html.splitlines() if line.strip())
+
+def _build_index_html():
+    try:
+        with app.app_context():
+            raw = _minify_html(render_template("sv.html")).encode("utf-8")
+        return raw, gzip.compress(raw, compresslevel=9)
+    except Exception as e:
+        logger.warning(f"Index pre-render failed (will render per request): {e}")
+        return None, None
+
+INDEX_HTML, INDEX_HTML_GZ = _build_index_html()
+
 @app.before_request
 def log_request_brief():
     # Lightweight logging: show method and path. Avoid logging bodies for all requests to reduce noise,
     # but for /api/chat we will log body inside handler.
-    logger.debug(f"Incoming request: {request.method} {request.path}")
+    logger.debug("Incoming request: %s %s", request.method, request.path)
 
 @app.route("/")
 def index():
+    if INDEX_HTML is not None:
+        # Parsed header, so "gzip;q=0" counts as a refusal (the quality also covers "*")
+        use_gzip = request.accept_encodings["gzip"] > 0
+        resp = make_response(INDEX_HTML_GZ if use_gzip else INDEX_HTML, 200)
+        resp.headers["Content-Type"] = "text/html; charset=utf-8"
+        resp.headers["Vary"] = "Accept-Encoding"
+        if use_gzip:
+            resp.headers["Content-Encoding"] = "gzip"
+        return resp
     try:
         return render_template("sv.html")
     except Exception as e:
         logger.error(f"Render template error: {e}", exc_info=True)
         return f"<h3>UI not found — {e}</h3>", 404
 
-@app.route("/api/chat", methods=["POST", "OPTIONS"])
-def api_chat():
-    if request.method == "OPTIONS":
-        # Reply simple preflight
-        return json_response({"ok": True, "msg": "preflight"}, 200)
+def _read_chat_message(route):
+    """Parse the chat message from JSON, form or raw-text bodies.
 
-    try:
-        # Log headers (useful to debug clients like ESP32)
+    Returns (message, None) on success or (None, error_response).
+    """
+    # Reject oversized bodies before reading/parsing them
+    if request.content_length and request.content_length > MAX_BODY_BYTES:
+        return None, json_bytes_response(ERR_TOO_LARGE_BODY, 413)
+
+    log_info = logger.isEnabledFor(logging.INFO)
+
+    # Log headers (useful to debug clients like ESP32)
+    if log_info:
         try:
-            hdrs = dict(request.headers)
-            logger.info(f"/api/chat headers: {hdrs}")
+            logger.info("%s headers: %s", route, dict(request.headers))
         except Exception:
             logger.warning("Could not read request headers fully")
 
-        # Try to read JSON safely
-        data = None
+    # Read the body once as bytes (cached, so form parsing below still sees it)
+    raw_body = b""
+    try:
+        raw_body = request.get_data() or b""
+    except RequestEntityTooLarge:
+        return None, json_bytes_response(ERR_TOO_LARGE_BODY, 413)
+    except Exception as e:
+        logger.warning(f"get_data() exception: {e}")
+    # Chunked bodies carry no Content-Length: depending on the werkzeug version, reading past
+    # MAX_CONTENT_LENGTH either raises (above) or stops at the cap with the body truncated
+    if request.content_length is None and len(raw_body) >= MAX_BODY_BYTES:
+        return None, json_bytes_response(ERR_TOO_LARGE_BODY, 413)
+
+    if log_info:
+        logger.info("%s raw_body_len=%d preview=%s", route, len(raw_body), raw_body[:800].decode("utf-8", "replace"))
+
+    # Single JSON parse of the raw bytes, whatever the Content-Type
+    data = None
+    if raw_body:
         try:
-            data = request.get_json(force=False, silent=True)
-        except Exception as e:
-            logger.warning(f"get_json() exception: {e}")
+            data = json_loads(raw_body)
+        except Exception:
+            data = None
+
+    # Support form data
+    if not data and request.form:
+        data = request.form.to_dict()
+
+    # Not JSON and not a form: treat the raw body as the message
+    if data is None and raw_body:
+        data = {"message": raw_body.decode("utf-8", "replace").strip()}
+
+    if not data:
+        return None, json_bytes_response(ERR_INVALID_BODY, 400)
+
+    message = data.get("message") if isinstance(data, dict) else None
+    message = message.strip() if isinstance(message, str) else ""
+    if not message:
+        return None, json_bytes_response(ERR_EMPTY_BODY, 400)
+    if len(message) > 1500:
+        return None, json_bytes_response(ERR_TOO_LONG_BODY, 400)
+    return message, None
+
+def _shortcut_reply(message, message_lower):
+    # Clear command / time question answered locally; None means "ask the model"
+    if len(message_lower) <= CLEAR_COMMAND_MAX_LEN and message_lower in CLEAR_COMMANDS:
+        bot.clear_history()
+        return "Đã xóa lịch sử chat."
 
-        raw_body = ""
-        try:
-            raw_body = request.get_data(as_text=True) or ""
-        except Exception as e:
-            logger.warning(f"get_data() exception: {e}")
+    if TIME_KEYWORDS_RE.search(message):
+        time_info = bot.get_vietnam_time_info()
+        reply = f"Hiện tại là {time_info['full_datetime']} tại {time_info['location']}."
+        bot.record_turn(message, reply)
+        return reply
+    return None
 
-        logger.info(f"/api/chat raw_body_len={len(raw_body)} preview={raw_body[:800]}")
+def sse_event(data):
+    # One Server-Sent Events frame carrying a JSON payload
+    return b"data: " + json_dumps(data) + b"\n\n"
 
-        # Support form data
-        if not data and request.form:
-            data = request.form.to_dict()
+_SSE_DELTA_HEAD = b'data: {"delta":'
+_SSE_DELTA_TAIL = b'}\n\n'
+# no-transform / X-Accel-Buffering stop proxies (nginx, CDNs) from compressing or buffering frames
+SSE_HEADERS = {"Cache-Control": "no-cache, no-transform", "X-Accel-Buffering": "no"}
 
-        # If still empty but raw present: try parse JSON or fallback to treat raw as message
-        if not data and raw_body:
-            try:
-                parsed = json.loads(raw_body)
-                if isinstance(parsed, dict):
-                    data = parsed
-            except Exception:
-                data = {"message": raw_body.strip()}
-
-        if not data:
-            return json_response({"ok": False, "error": "Invalid JSON or empty body"}, 400)
-
-        message = (data.get("message") or "").strip() if isinstance(data, dict) else ""
-        if not message:
-            return json_response({"ok": False, "error": "Empty message"}, 400)
-        if len(message) > 1500:
-            return json_response({"ok": False, "error": "Message too long"}, 400)
-
-        # Quick commands
-        if message.lower() in ("clear","/clear","xóa","xoa"):
-            bot.clear_history()
-            return json_response({"ok": True, "reply": "Đã xóa lịch sử chat."}, 200)
-
-        # Time shortcut handled locally
-        time_keywords = ["giờ","thời gian","ngày","tháng","năm","bây giờ","hiện tại"]
-        if any(k in message.lower() for k in time_keywords):
-            time_info = bot.get_vietnam_time_info()
-            reply = f"Hiện tại là {time_info['full_datetime']} tại {time_info['location']}."
-            ts = bot._now_ts()
-            with bot._lock:
-                bot.messages.append({"role":"user","content":message,"timestamp":ts})
-                bot.messages.append({"role":"assistant","content":reply,"timestamp":ts})
+def sse_delta(text):
+    # Same bytes as sse_event({"delta": text}) without building a dict per frame;
+    # json_dumps still does the string escaping
+    return _SSE_DELTA_HEAD + json_dumps(text) + _SSE_DELTA_TAIL
+
+@app.route("/api/chat", methods=["POST", "OPTIONS"])
+def api_chat():
+    if request.method == "OPTIONS":
+        # Reply simple preflight
+        return json_bytes_response(PREFLIGHT_BODY, 200)
+
+    try:
+        message, error = _read_chat_message("/api/chat")
+        if error is not None:
+            return error
+
+        # Lowercased once per turn: clear-command check and reply-cache key share it
+        message_lower = message.lower()
+        reply = _shortcut_reply(message, message_lower)
+        if reply is not None:
             return json_response({"ok": True, "reply": reply}, 200)
 
         # Normal LLM call (wrapped)
         try:
-            reply = bot.get_response_ultra_fast(message)
+            reply = bot.get_response_ultra_fast(message, message_lower)
             if not reply:
                 reply = "Xin lỗi, hệ thống tạm thời bận. Vui lòng thử lại."
         except Exception as e:
@@ -274,15 +562,74 @@ def api_chat():
 
     except Exception as e:
         logger.error(f"/api/chat unexpected error: {e}", exc_info=True)
-        return json_response({"ok": False, "error": "Server error"}, 500)
+        return json_bytes_response(ERR_SERVER_BODY, 500)
+
+@app.route("/api/chat/stream", methods=["POST", "OPTIONS"])
+def api_chat_stream():
+    if request.method == "OPTIONS":
+        return json_bytes_response(PREFLIGHT_BODY, 200)
+
+    try:
+        message, error = _read_chat_message("/api/chat/stream")
+        if error is not None:
+            return error
+        # Lowercased once per turn: clear-command check and reply-cache key share it
+        message_lower = message.lower()
+        reply = _shortcut_reply(message, message_lower)
+    except Exception as e:
+        logger.error(f"/api/chat/stream unexpected error: {e}", exc_info=True)
+        return json_bytes_response(ERR_SERVER_BODY, 500)
+
+    def generate():
+        # Frames: {"delta": text}* then [DONE]; {"error": ...} if the model call blows up,
+        # also after partial deltas, so the client knows the reply was cut off
+        buf = []
+        try:
+            if reply is not None:
+                yield sse_delta(reply)
+            else:
+                # SSE comment frame: pushes headers through proxies before the model's first token
+                yield b": ping\n\n"
+                # Coalesce model chunks: one frame per SSE_FLUSH_CHARS or SSE_FLUSH_MS, whichever first
+                flush_after = SSE_FLUSH_MS / 1000.0
+                buf_len = 0
+                last_flush = time.monotonic()
+                for delta in bot.stream_response(message, message_lower):
+                    buf.append(delta)
+                    buf_len += len(delta)
+                    now = time.monotonic()
+                    if buf_len >= SSE_FLUSH_CHARS or now - last_flush >= flush_after:
+                        yield sse_delta("".join(buf))
+                        buf.clear()
+                        buf_len = 0
+                        last_flush = now
+                if buf:
+                    yield sse_delta("".join(buf))
+                    buf.clear()
+        except Exception as e:
+            logger.error(f"/api/chat/stream generator error: {e}", exc_info=True)
+            if buf:
+                yield sse_delta("".join(buf))
+            yield sse_event({"error": "Hệ thống đang bận, vui lòng thử lại sau ít phút."})
+        yield b"data: [DONE]\n\n"
+
+    return Response(generate(), mimetype="text/event-stream", headers=SSE_HEADERS)
 
 @app.route("/api/history", methods=["GET"])
 def api_history():
     try:
-        # Return last 30 messages
-        with bot._lock:
-            msgs = bot.messages[-30:]
-        return json_response({"ok": True, "messages": msgs}, 200)
+        # Return last 30 messages (pre-encoded body, rebuilt only after history changes)
+        etag, last_modified, body = bot.history_snapshot()
+        # Only the ETag validates: Last-Modified has 1s resolution, so a change within the same
+        # second as the previous response would still look unmodified
+        if request.headers.get("If-None-Match") == etag:
+            resp = make_response("", 304)
+        else:
+            resp = json_bytes_response(body, 200)
+        resp.headers["ETag"] = etag
+        resp.headers["Last-Modified"] = last_modified
+        resp.headers["Cache-Control"] = "no-cache"
+        return resp
     except Exception as e:
         logger.error(f"API history error: {e}", exc_info=True)
         return json_response({"ok": True, "messages": []}, 200)
@@ -291,27 +638,40 @@ def api_history():
 def api_clear():
     try:
         bot.clear_history()
-        return json_response({"ok": True, "message": "Cleared"}, 200)
+        return json_bytes_response(CLEARED_BODY, 200)
     except Exception as e:
         logger.error(f"API clear error: {e}", exc_info=True)
         return json_response({"ok": False, "error": "Error"}, 500)
 
+# Encoded /api/status body, reused while the clock second and history version are unchanged
+_status_cache = (None, None)  # ((epoch second, history version), body)
+
 @app.route("/api/status", methods=["GET"])
 def api_status():
+    global _status_cache
     try:
-        t = bot.get_vietnam_time_info()
-        return json_response({"ok": True, "status":"online", "messages_count": len(bot.messages), "vietnam_time": t['current_time']}, 200)
+        key = (int(time.time()), bot._history_version)
+        cached_key, body = _status_cache
+        if cached_key != key:
+            t = bot.get_vietnam_time_info()
+            body = json_dumps({"ok": True, "status":"online", "messages_count": bot.message_count(), "vietnam_time": t['current_time']})
+            _status_cache = (key, body)
+        return json_bytes_response(body, 200)
     except Exception as e:
         logger.error(f"API status error: {e}", exc_info=True)
         return json_response({"ok": True, "status":"online"}, 200)
 
 @app.errorhandler(404)
 def not_found(e):
-    return json_response({"ok": False, "error": "Not found"}, 404)
+    return json_bytes_response(ERR_NOT_FOUND_BODY, 404)
+
+@app.errorhandler(413)
+def too_large(e):
+    return json_bytes_response(ERR_TOO_LARGE_BODY, 413)
 
 @app.errorhandler(500)
 def internal_err(e):
-    return json_response({"ok": False, "error": "Server error"}, 500)
+    return json_bytes_response(ERR_SERVER_BODY, 500)
 
 # Optional: small background saver stub (no-op now but ready)
 @async_task
@@ -327,6 +687,17 @@ if __name__ == "__main__":
     # Start background thread
     executor.submit(background_maintainer)
     port = int(os.getenv("PORT", "5000"))
-    # debug=False for production; threaded=True to handle multiple requests
-    logger.info(f"Starting server on 0.0.0.0:{port}")
-    app.run(host="0.0.0.0", port=port, debug=False, threaded=True, use_reloader=False)
+    serve = None
+    if os.getenv("FLASK_ENV") != "development":
+        try:
+            from waitress import serve
+        except ImportError:
+            serve = None
+    if serve is not None:
+        # Threaded WSGI server with HTTP/1.1 keep-alive; long channel_timeout keeps SSE streams open
+        logger.info(f"Starting waitress on 0.0.0.0:{port}")
+        serve(app, host="0.0.0.0", port=port, threads=16, connection_limit=1000, channel_timeout=120)
+    else:
+        # Local/dev server only; see the header comment for the production command
+        logger.info(f"Starting server on 0.0.0.0:{port}")
+        app.run(host="0.0.0.0", port=port, debug=False, threaded=True, use_reloader=False)